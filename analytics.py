@@ -3,6 +3,22 @@ import os
 import glob
 from datetime import datetime
 
+# --- DEFINING GOOD BEHAVIOR ---
+# We now include 'Typing/Reading' as a positive engagement status
+POSITIVE_STATUSES = ['Attentive', 'Blinking', 'Typing/Reading']
+
+def engagement_from_statuses(statuses):
+    """
+    Percentage of frames whose status is a positive behavior.
+    Shared by the CSV scoring below and the offline landmark re-scoring.
+    """
+    statuses = pd.Series(statuses)
+    total_frames = len(statuses)
+    if total_frames == 0:
+        return 0
+    engaged_frames = int(statuses.isin(POSITIVE_STATUSES).sum())
+    return round((engaged_frames / total_frames) * 100, 2)
+
 # 1. The Math Function (Used for Single Session & History)
 def calculate_engagement(csv_path):
     """
@@ -13,22 +29,7 @@ def calculate_engagement(csv_path):
     try:
         # Load the session data
         df = pd.read_csv(csv_path)
-        total_frames = len(df)
-        
-        if total_frames == 0:
-            return 0
-            
-        # --- DEFINING GOOD BEHAVIOR ---
-        # We now include 'Typing/Reading' as a positive engagement status
-        positive_statuses = ['Attentive', 'Blinking', 'Typing/Reading']
-        
-        # Count frames where the status matches any of the positive ones
-        engaged_frames = len(df[df['status'].isin(positive_statuses)])
-        
-        # Calculate percentage
-        score = (engaged_frames / total_frames) * 100
-        
-        return round(score, 2)
+        return engagement_from_statuses(df['status'])
         
     except Exception as e:
         print(f"Error calculating score for {csv_path}: {e}")
@@ -1,29 +1,51 @@
 import os
+import time
+import threading
+import pandas as pd
 from datetime import datetime  # <--- NEW: Required for timestamps
 from flask import Flask, render_template, request, redirect, url_for, session, flash, Response,jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from werkzeug.security import generate_password_hash, check_password_hash
 from report_generator import generate_pdf_bytes
+import memory_guard
+from job_queue import JobQueue, DONE, FAILED
 
 # --- 1. IMPORT ANALYTICS & CAMERA ---
 try:
     from detection import VideoCamera
-    # We only need calculate_engagement now. We don't need get_all_reports anymore.
-    from analytics import calculate_engagement 
+    # Scoring runs in finalize_report, which needs the raw helper so errors reach the job queue
+    from analytics import engagement_from_statuses
 except ImportError:
     print("WARNING: detection.py or analytics.py not found.")
     class VideoCamera: pass
-    def calculate_engagement(f): return 0
+    def engagement_from_statuses(statuses):
+        raise RuntimeError("analytics.py is not available")
 
 app = Flask(__name__)
 app.secret_key = "mca_project_secret_key"
+# Set RECORD_LANDMARKS=1 to keep per-frame landmarks for offline re-scoring
+app.config['RECORD_LANDMARKS'] = os.environ.get('RECORD_LANDMARKS') == '1'
+# Memory guard: in-memory log cap per session, and idle time before a camera counts as abandoned
+app.config['SESSION_MEMORY_CAP_MB'] = float(os.environ.get('SESSION_MEMORY_CAP_MB', 8))
+app.config['SESSION_IDLE_TIMEOUT'] = float(os.environ.get('SESSION_IDLE_TIMEOUT', memory_guard.DEFAULT_IDLE_TIMEOUT))
+# /memory_stats is off unless MEMORY_STATS=1; allocation snapshots also need TRACEMALLOC=1
+app.config['MEMORY_STATS'] = os.environ.get('MEMORY_STATS') == '1'
+app.config['TRACEMALLOC'] = os.environ.get('TRACEMALLOC') == '1'
+if app.config['TRACEMALLOC']:
+    memory_guard.start_tracing()
+# Background workers that score finished sessions (see finalize_report)
+app.config['FINALIZE_WORKERS'] = int(os.environ.get('FINALIZE_WORKERS', 4))
 
 # --- 2. GLOBAL CAMERA VARIABLE ---
 global_camera = None 
+# Guards global_camera between requests and the abandoned-session reaper
+camera_lock = threading.Lock()
 
 # --- DATABASE SETUP ---
 basedir = os.path.abspath(os.path.dirname(__file__))
-db_path = os.path.join(basedir, 'users.db')
+# USERS_DB / JOBS_DB move the databases elsewhere (the soak test points them at a temp folder)
+db_path = os.environ.get('USERS_DB', os.path.join(basedir, 'users.db'))
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
@@ -48,10 +70,56 @@ class Report(db.Model):
     filename = db.Column(db.String(100), nullable=False)
     score = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.now)
+    # 'pending' until the background job has scored the session, then 'ready'
+    status = db.Column(db.String(20), nullable=False, default='ready')
 
 # Create DB if not exists
 with app.app_context():
     db.create_all()
+    # create_all() doesn't add columns to an existing table, so older users.db files need this
+    if 'status' not in [c['name'] for c in inspect(db.engine).get_columns('report')]:
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE report ADD COLUMN status VARCHAR(20) NOT NULL DEFAULT 'ready'"))
+
+# --- BACKGROUND FINALIZATION QUEUE ---
+# Scoring a session happens off the request; jobs live in jobs.db and survive restarts
+finalize_queue = JobQueue(os.environ.get('JOBS_DB', os.path.join(basedir, 'jobs.db')),
+                          workers=app.config['FINALIZE_WORKERS'])
+
+def finalize_report(payload):
+    # Safe to re-run: it only recomputes the score from the saved CSV.
+    # Errors are left to propagate (unlike calculate_engagement, which returns 0),
+    # so a missing or unreadable CSV is retried and then marked failed, never scored 0.
+    with app.app_context():
+        report = db.session.get(Report, payload['report_id'])
+        # A recreated users.db can hand an old id to a new report; only score the session this job was for
+        if report is None or report.status == 'ready' or report.filename != payload.get('filename'):
+            return
+        df = pd.read_csv(os.path.join('reports', report.filename))
+        report.score = engagement_from_statuses(df['status'])
+        report.status = 'ready'
+        db.session.commit()
+
+finalize_queue.register('finalize_report', finalize_report)
+
+def finalize_job_key(report):
+    # Report ids can be reused, so the session file is part of the key
+    return f"finalize_report:{report.id}:{report.filename}"
+
+def queue_finalize(report):
+    # Only called for pending reports: a job already 'done' means its result was lost, so run it again
+    key = finalize_job_key(report)
+    finalize_queue.submit('finalize_report', {'report_id': report.id, 'filename': report.filename}, key=key)
+    job = finalize_queue.get(key=key)
+    if job and job['state'] == DONE:
+        finalize_queue.requeue(key)
+
+def start_finalize_workers():
+    # Re-queue reports whose job never made it to disk (the key makes this a no-op otherwise)
+    with app.app_context():
+        for report in Report.query.filter_by(status='pending').all():
+            queue_finalize(report)
+    finalize_queue.start()
 
 # --- ROUTES ---
 
@@ -124,9 +192,66 @@ def monitor():
 @app.route('/video_feed')
 def video_feed():
     global global_camera 
-    if global_camera is None:
-        global_camera = VideoCamera()
-    return Response(gen(global_camera), mimetype='multipart/x-mixed-replace; boundary=frame')
+    with camera_lock:
+        if global_camera is None:
+            global_camera = VideoCamera(
+                record_landmarks=app.config['RECORD_LANDMARKS'],
+                max_session_bytes=int(app.config['SESSION_MEMORY_CAP_MB'] * 1024 * 1024))
+        camera = global_camera
+    return Response(gen(camera), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# --- ABANDONED SESSION CLEANUP ---
+# A tab closed without /stop_analysis leaves the camera open; save its data and release it
+def reap_abandoned_sessions():
+    global global_camera
+    with camera_lock:
+        camera = global_camera
+        if camera is None or not camera.is_idle(app.config['SESSION_IDLE_TIMEOUT']):
+            return None
+        global_camera = None
+    filename = camera.stop_and_save()
+    print(f"Released abandoned session {camera.start_time} (saved: {filename})")
+    return filename
+
+def start_session_reaper(interval=30):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                reap_abandoned_sessions()
+            except Exception as e:
+                print(f"Session reaper error: {e}")
+    threading.Thread(target=loop, name='session-reaper', daemon=True).start()
+
+# --- BACKGROUND THREADS ---
+# Started by the first request, once per process, so they run under any server
+# (and not in the debug reloader's watcher process, which never serves requests)
+background_started = False
+background_lock = threading.Lock()
+
+@app.before_request
+def start_background_threads():
+    global background_started
+    if background_started:
+        return
+    with background_lock:
+        if background_started:
+            return
+        start_session_reaper()
+        start_finalize_workers()
+        background_started = True
+
+# --- MEMORY STATS API ---
+# /memory_stats?snapshot=1 adds the top tracemalloc allocation sites (needs TRACEMALLOC=1)
+@app.route('/memory_stats')
+def memory_stats():
+    if not app.config['MEMORY_STATS']:
+        return "Not Found", 404
+    if 'user_id' not in session:
+        return jsonify({}), 401
+    with camera_lock:
+        camera = global_camera
+    return jsonify(memory_guard.memory_report(camera, snapshot=request.args.get('snapshot') == '1'))
 
 
 # --- STOP ANALYSIS & SAVE TO DB ---
@@ -143,28 +268,67 @@ def stop_analysis():
     
     current_user_id = session['user_id']
 
-    if global_camera:
-        filename = global_camera.stop_and_save()
-        global_camera = None 
+    with camera_lock:
+        camera = global_camera
+        global_camera = None
+
+    if camera:
+        filename = camera.stop_and_save()
         
         if filename:
-            final_score = calculate_engagement(filename)
-            
             # --- PENALTY LOGIC ---
-            if violation_reason == 'tab_switch':
+            # A violation scores 0 outright, so there is nothing left to compute
+            tab_switch = violation_reason == 'tab_switch'
+            if tab_switch:
                 print("Session terminated due to Tab Switching.")
-                final_score = 0  # <--- THIS MUST BE UNCOMMENTED
             
             new_report = Report(
                 user_id=current_user_id,
                 filename=os.path.basename(filename),
-                score=final_score
+                score=final_score,
+                status='ready' if tab_switch else 'pending'
             )
             db.session.add(new_report)
             db.session.commit()
             report_id = new_report.id
 
+            # Scoring runs on the job queue; the report page polls until it is ready
+            if not tab_switch:
+                queue_finalize(new_report)
+            return redirect(url_for('view_report', report_id=report_id, violation=violation_reason))
+
     return render_template('report.html', score=final_score, report_id=report_id, violation=violation_reason)
+
+# --- REPORT PAGE ---
+@app.route('/report/<int:report_id>')
+def view_report(report_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    report = Report.query.get_or_404(report_id)
+    if report.user_id != session['user_id']:
+        return "Unauthorized Access", 403
+
+    return render_template('report.html', score=report.score, report_id=report.id,
+                           violation=request.args.get('violation'), pending=report.status != 'ready')
+
+@app.route('/report_status/<int:report_id>')
+def report_status(report_id):
+    if 'user_id' not in session:
+        return jsonify({}), 401
+
+    report = Report.query.get_or_404(report_id)
+    if report.user_id != session['user_id']:
+        return jsonify({}), 403
+
+    status = report.status
+    if status == 'pending':
+        job = finalize_queue.get(key=finalize_job_key(report))
+        if job is None or job['state'] == DONE:
+            queue_finalize(report)
+        elif job['state'] == FAILED:
+            status = 'failed'
+    return jsonify({'status': status, 'score': report.score})
 # --- ARCHIVES ROUTE  ---
 @app.route('/archives')
 def archives():
@@ -174,7 +338,7 @@ def archives():
     
     # 2. Query Database
     # Fetch only reports that match the current User ID
-    user_reports = Report.query.filter_by(user_id=session['user_id']).order_by(Report.timestamp.desc()).all()
+    user_reports = Report.query.filter_by(user_id=session['user_id'], status='ready').order_by(Report.timestamp.desc()).all()
     
     # 3. Format Data for Template
     formatted_reports =[]
@@ -196,7 +360,7 @@ def heatmap_data():
         return jsonify([]) 
 
     # 1. Get all reports for the current user
-    reports = Report.query.filter_by(user_id=session['user_id']).all()
+    reports = Report.query.filter_by(user_id=session['user_id'], status='ready').all()
 
     # 2. Prepare a 7x24 Grid (7 Days, 24 Hours)
     # Day 0 = Mon, Day 6 = Sun
@@ -249,6 +413,8 @@ def download_report(report_id):
     # 2. Security Check
     if report.user_id != user.id:
         return "Unauthorized Access", 403
+    if report.status != 'ready':
+        return "Report is still being finalized. Please try again shortly.", 409
 
     # 3. Use the function from the other file
     pdf_content = generate_pdf_bytes(
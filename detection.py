@@ -6,10 +6,20 @@ import numpy as np
 from scipy.spatial import distance as dist
 import os
 import time
+import threading
 from datetime import datetime
+from landmark_store import LandmarkRecorder
+import memory_guard
+from memory_guard import SessionLog
 
 class VideoCamera(object):
-    def __init__(self):
+    def __init__(self, record_landmarks=False, max_session_bytes=memory_guard.DEFAULT_SESSION_CAP_BYTES,
+                 video=None, face_mesh=None):
+        # get_frame runs in the /video_feed thread while close() can come from
+        # /stop_analysis or the reaper, so both hold this lock
+        self._lock = threading.Lock()
+        self.stopped = False
+
         # --- 1. MODEL & MEDIAPIPE SETUP ---
         self.model_path = 'engagement_model.pkl'
         self.model = None
@@ -19,11 +29,13 @@ class VideoCamera(object):
         
         self.mp_face_mesh = mp.solutions.face_mesh
         # refine_landmarks=True is CRITICAL for gaze tracking
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
+        self.face_mesh = face_mesh or self.mp_face_mesh.FaceMesh(
             max_num_faces=2, 
             min_detection_confidence=0.5, 
             min_tracking_confidence=0.5, 
             refine_landmarks=True)
+        memory_guard.track(self, 'VideoCamera')
+        memory_guard.track(self.face_mesh, 'FaceMesh')
         
         # --- 2. THRESHOLDS & LOGIC ---
         self.eye_closed_start = None
@@ -35,14 +47,43 @@ class VideoCamera(object):
         self.GAZE_RIGHT_LIMIT = 0.62
 
         # --- 3. DATA LOGGING ---
-        self.session_data = []  
         self.start_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Spills to the CSV once it reaches max_session_bytes, so long sessions stay flat
+        self.session_log = SessionLog(f"reports/session_{self.start_time}.csv", max_bytes=max_session_bytes)
+        self.last_active = time.time()
+        # Optional raw landmark log so sessions can be re-scored offline (see landmark_store.py)
+        self.landmark_recorder = None
+        if record_landmarks:
+            self.landmark_recorder = LandmarkRecorder(f"reports/session_{self.start_time}.lmk")
         
-        self.video = cv2.VideoCapture(0)
+        self.video = video or cv2.VideoCapture(0)
 
     def __del__(self):
-        if self.video.isOpened():
-            self.video.release()
+        self.close()
+
+    def close(self):
+        # Releases the webcam and the FaceMesh graph; safe to call more than once.
+        # Waits for a frame in progress, and get_frame returns None from then on.
+        with self._lock:
+            self.stopped = True
+            if self.video.isOpened():
+                self.video.release()
+            if self.face_mesh is not None:
+                self.face_mesh.close()
+                self.face_mesh = None
+
+    def is_idle(self, timeout=memory_guard.DEFAULT_IDLE_TIMEOUT):
+        return time.time() - self.last_active > timeout
+
+    def memory_usage(self):
+        return {
+            'start_time': self.start_time,
+            'frames_logged': len(self.session_log),
+            'buffered_rows': len(self.session_log.rows),
+            'buffer_bytes': self.session_log.nbytes,
+            'buffer_cap_bytes': self.session_log.max_bytes,
+            'idle_seconds': round(time.time() - self.last_active, 1),
+        }
 
     def calculate_EAR(self, eye_points, landmarks):
         try:
@@ -67,20 +108,25 @@ class VideoCamera(object):
             return 0.5
 
     def stop_and_save(self):
-        self.video.release()
-        if len(self.session_data) > 0:
-            if not os.path.exists('reports'):
-                os.makedirs('reports')
-            
-            filename = f"reports/session_{self.start_time}.csv"
-            df = pd.DataFrame(self.session_data, columns=['timestamp', 'status'])
-            df.to_csv(filename, index=False)
-            return filename
+        # After close() no frame can still be logging, so the final flush is complete
+        self.close()
+        if self.landmark_recorder:
+            self.landmark_recorder.close()
+        if len(self.session_log) > 0:
+            self.session_log.flush()
+            return self.session_log.filename
         return None
 
     def get_frame(self):
+        with self._lock:
+            if self.stopped:
+                return None
+            return self._analyse_frame()
+
+    def _analyse_frame(self):
         success, frame = self.video.read()
         if not success: return None
+        self.last_active = time.time()
 
         image = cv2.cvtColor(cv2.flip(frame, 1), cv2.COLOR_BGR2RGB)
         image.flags.writeable = False
@@ -92,10 +138,14 @@ class VideoCamera(object):
         box_color = (200, 200, 200)
 
         if results.multi_face_landmarks:
+            if self.landmark_recorder:
+                h, w, c = image.shape
+                self.landmark_recorder.record(results.multi_face_landmarks, w, h, time.time())
+
             if len(results.multi_face_landmarks) > 1:
                 status = "WARNING: Multiple Faces!"
                 box_color = (0, 0, 255)
-                self.session_data.append({'timestamp': time.time(), 'status': 'Cheating'})
+                self.session_log.append(time.time(), 'Cheating')
                 cv2.rectangle(image, (0,0), (640, 60), box_color, -1)
                 cv2.putText(image, status, (10,40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 3)
 
@@ -167,7 +217,7 @@ class VideoCamera(object):
                             status = "Attentive"
                             box_color = (0, 255, 0)
 
-                    self.session_data.append({'timestamp': time.time(), 'status': status})
+                    self.session_log.append(time.time(), status)
                     cv2.rectangle(image, (0,0), (450, 60), box_color, -1)
                     cv2.putText(image, status, (10,40), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
 
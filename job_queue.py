@@ -0,0 +1,200 @@
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue(object):
+    """
+    A small durable job queue stored in a local SQLite file.
+
+    Jobs are committed to disk before submit() returns and are worked off by a
+    pool of background threads. Jobs that were running when the process died
+    are put back to pending by start(), so handlers must be safe to re-run.
+    A failed job is retried after retry_delay seconds, doubling each attempt.
+    """
+
+    def __init__(self, db_path, workers=2, max_attempts=3, poll_interval=1.0, retry_delay=5.0):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.handlers = {}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                job_key TEXT UNIQUE,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                run_after REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+            # jobs.db files from before retries were delayed
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'run_after' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN run_after REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def _connect(self):
+        # One connection per call/thread; SQLite connections can't be shared across threads
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def submit(self, kind, payload, key=None):
+        """
+        Stores a job and wakes a worker. A job with the same key is only ever
+        queued once, which makes re-submitting after a crash harmless.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO jobs (kind, job_key, payload, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(payload), PENDING, now, now))
+            if key is None:
+                job_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            else:
+                job_id = conn.execute("SELECT id FROM jobs WHERE job_key = ?", (key,)).fetchone()[0]
+        self._wakeup.set()
+        return job_id
+
+    def requeue(self, key):
+        """Runs a finished job again, e.g. when its result was lost. Returns False if there is none."""
+        with closing(self._connect()) as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET state = ?, attempts = 0, error = NULL, run_after = 0, updated_at = ? "
+                "WHERE job_key = ? AND state IN (?, ?)",
+                (PENDING, time.time(), key, DONE, FAILED)).rowcount
+        if updated:
+            self._wakeup.set()
+        return bool(updated)
+
+    def get(self, job_id=None, key=None):
+        with closing(self._connect()) as conn:
+            if key is not None:
+                row = conn.execute("SELECT * FROM jobs WHERE job_key = ?", (key,)).fetchone()
+            else:
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    # --- WORKERS ---
+
+    def start(self):
+        with closing(self._connect()) as conn:
+            resumed = conn.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?",
+                (PENDING, time.time(), RUNNING)).rowcount
+        if resumed:
+            print(f"Job queue: resuming {resumed} interrupted job(s)")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim(self, conn):
+        # BEGIN IMMEDIATE takes the write lock, so two workers can't claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE state = ? AND run_after <= ? ORDER BY id LIMIT 1",
+                (PENDING, time.time())).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (RUNNING, time.time(), row['id']))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return dict(row) if row else None
+
+    def _finish(self, conn, job, error=None):
+        now = time.time()
+        run_after = 0
+        attempts = job['attempts'] + 1
+        if error is None:
+            state = DONE
+        elif attempts >= self.max_attempts:
+            state = FAILED
+        else:
+            state = PENDING
+            run_after = now + self.retry_delay * 2 ** (attempts - 1)
+        conn.execute(
+            "UPDATE jobs SET state = ?, error = ?, run_after = ?, updated_at = ? WHERE id = ?",
+            (state, error, run_after, now, job['id']))
+
+    def _work(self):
+        conn = None
+        finished = None   # (job, error) whose result still has to be written
+        backoff = self.poll_interval
+        while not self._stopping.is_set():
+            # Database errors (e.g. "database is locked") must never end the thread:
+            # log, drop the connection, wait and try again
+            try:
+                if conn is None:
+                    conn = self._connect()
+                if finished is not None:
+                    self._finish(conn, *finished)
+                    finished = None
+
+                job = self._claim(conn)
+                backoff = self.poll_interval
+                if job is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+
+                handler = self.handlers.get(job['kind'])
+                try:
+                    if handler is None:
+                        raise LookupError(f"No handler registered for '{job['kind']}'")
+                    handler(json.loads(job['payload']))
+                except Exception as e:
+                    print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+                    finished = (job, str(e))
+                else:
+                    finished = (job, None)
+                self._finish(conn, *finished)
+                finished = None
+            except Exception as e:
+                print(f"Job worker error (retrying in {backoff:.0f}s): {e}")
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 60)
+        if conn is not None:
+            conn.close()
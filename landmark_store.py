@@ -0,0 +1,227 @@
+import os
+import glob
+import pickle
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from analytics import engagement_from_statuses
+
+# --- 1. ON-DISK FORMAT ---
+# One fixed-size record per analysed frame, appended to "reports/session_<start>.lmk".
+# Landmarks are stored normalised (as MediaPipe returns them) in float16, which keeps
+# a frame at ~2.9 KB and lets np.memmap open a session without reading it into RAM.
+NUM_LANDMARKS = 478
+LANDMARK_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('faces', 'u1'),      # number of faces MediaPipe found (>1 means "Cheating")
+    ('width', '<u2'),     # frame size, needed to rebuild the pixel coords used by EAR/gaze
+    ('height', '<u2'),
+    ('landmarks', '<f2', (NUM_LANDMARKS, 3)),
+])
+
+# Same defaults as VideoCamera.__init__ - pass overrides to replay with new values
+DEFAULT_THRESHOLDS = {
+    'SLEEP_TIME_THRESHOLD': 3.0,
+    'EAR_THRESHOLD': 0.20,
+    'HEAD_TILT_THRESHOLD': 0.13,
+    'GAZE_LEFT_LIMIT': 0.38,
+    'GAZE_RIGHT_LIMIT': 0.62,
+}
+
+LEFT_EYE = [33, 160, 158, 133, 153, 144]
+RIGHT_EYE = [362, 385, 387, 263, 373, 380]
+NOSE_TIP, CHIN = 1, 152
+LEFT_IRIS, RIGHT_IRIS = 468, 473
+
+# Only these landmarks feed the rule-based checks; replay reads just these columns
+USED_LANDMARKS = sorted(set(LEFT_EYE + RIGHT_EYE + [NOSE_TIP, CHIN, LEFT_IRIS, RIGHT_IRIS]))
+_COLUMN = {index: column for column, index in enumerate(USED_LANDMARKS)}
+# Frames per model.predict call, so feature rows are never built for a whole session at once
+MODEL_CHUNK_FRAMES = 2048
+
+
+class LandmarkRecorder(object):
+    """Appends one LANDMARK_DTYPE record per analysed frame to a session file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.frames = 0
+        self._file = None
+        self._record = np.zeros(1, dtype=LANDMARK_DTYPE)
+
+    def record(self, multi_face_landmarks, width, height, timestamp):
+        rec = self._record[0]
+        rec['timestamp'] = timestamp
+        rec['faces'] = min(len(multi_face_landmarks), 255)
+        rec['width'] = width
+        rec['height'] = height
+        if len(multi_face_landmarks) == 1:
+            points = multi_face_landmarks[0].landmark
+            rec['landmarks'] = [(lm.x, lm.y, lm.z) for lm in points[:NUM_LANDMARKS]]
+        else:
+            # The decision for several faces doesn't depend on the landmarks
+            rec['landmarks'] = 0
+
+        if self._file is None:
+            folder = os.path.dirname(self.filename)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self._file = open(self.filename, 'ab')
+        self._record.tofile(self._file)
+        self.frames += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self.filename if self.frames > 0 else None
+
+
+def load_landmarks(path):
+    """
+    Memory-maps a .lmk session file as a structured array (read-only).
+    A partial record left by a process killed mid-write is ignored.
+    """
+    frames = os.path.getsize(path) // LANDMARK_DTYPE.itemsize
+    if frames == 0:
+        return np.zeros(0, dtype=LANDMARK_DTYPE)
+    return np.memmap(path, dtype=LANDMARK_DTYPE, mode='r', shape=(frames,))
+
+
+# --- 2. VECTORISED REPLAY OF VideoCamera.get_frame ---
+
+def _distance(points, a, b):
+    # points holds the USED_LANDMARKS columns only
+    diff = points[:, _COLUMN[a], :] - points[:, _COLUMN[b], :]
+    return np.hypot(diff[:, 0], diff[:, 1])
+
+
+def _ear(points, eye):
+    A = _distance(points, eye[1], eye[5])
+    B = _distance(points, eye[2], eye[4])
+    C = _distance(points, eye[0], eye[3])
+    # Like calculate_EAR (numpy floats don't raise), corners on the same pixel give
+    # inf/nan, which never compares below EAR_THRESHOLD
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (A + B) / (2.0 * C)
+
+
+def _gaze(points, inner, outer, iris):
+    eye_width = _distance(points, inner, outer)
+    iris_dist = _distance(points, inner, iris)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(eye_width == 0, 0.5, iris_dist / eye_width)
+
+
+def replay_statuses(records, model=None, **thresholds):
+    """
+    Re-runs the get_frame decision logic over a whole recorded session at once.
+    Returns an array with the status that would have been logged for each frame.
+    """
+    settings = dict(DEFAULT_THRESHOLDS)
+    unknown = set(thresholds) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown thresholds: {', '.join(sorted(unknown))}")
+    settings.update(thresholds)
+
+    statuses = np.full(len(records), 'Cheating', dtype=object)
+    single = np.asarray(records['faces']) == 1
+    if not single.any():
+        return statuses
+
+    frames = np.flatnonzero(single)
+    timestamps = np.asarray(records['timestamp'])[single]
+    # Pull only the used landmark columns out of the memmap before widening to float64
+    landmarks = np.asarray(records['landmarks'][frames[:, None], USED_LANDMARKS, :2], dtype=np.float64)
+    w = np.asarray(records['width'][single], dtype=np.float64)[:, None]
+    h = np.asarray(records['height'][single], dtype=np.float64)[:, None]
+
+    # get_frame measures distances on int() pixel coordinates
+    points = np.stack([np.trunc(landmarks[:, :, 0] * w), np.trunc(landmarks[:, :, 1] * h)], axis=-1)
+
+    head_tilt = landmarks[:, _COLUMN[CHIN], 1] - landmarks[:, _COLUMN[NOSE_TIP], 1]
+    avgEAR = (_ear(points, LEFT_EYE) + _ear(points, RIGHT_EYE)) / 2.0
+    left_gaze = _gaze(points, 133, 33, LEFT_IRIS)
+    right_gaze = _gaze(points, 362, 263, RIGHT_IRIS)
+    is_side_looking = (left_gaze < settings['GAZE_LEFT_LIMIT']) | (left_gaze > settings['GAZE_RIGHT_LIMIT']) | \
+                      (right_gaze < settings['GAZE_LEFT_LIMIT']) | (right_gaze > settings['GAZE_RIGHT_LIMIT'])
+
+    eyes_closed = avgEAR < settings['EAR_THRESHOLD']
+    typing = eyes_closed & (head_tilt < settings['HEAD_TILT_THRESHOLD'])
+    drowsy = eyes_closed & ~typing
+
+    # eye_closed_start: the first frame of each unbroken run of drowsy frames.
+    # Multi-face frames don't touch it, so runs are counted over single-face frames only.
+    index = np.arange(len(drowsy))
+    run_begins = drowsy & ~np.concatenate(([False], drowsy[:-1]))
+    run_start = np.maximum.accumulate(np.where(run_begins, index, 0))
+    elapsed = timestamps - timestamps[run_start]
+
+    result = np.full(len(drowsy), 'Attentive', dtype=object)
+    result[typing] = 'Typing/Reading'
+    result[drowsy] = np.where(elapsed[drowsy] >= settings['SLEEP_TIME_THRESHOLD'], 'Sleeping', 'Blinking')
+
+    eyes_open = ~eyes_closed
+    result[eyes_open & is_side_looking] = 'Looking Away '
+
+    needs_model = np.flatnonzero(eyes_open & ~is_side_looking)
+    if model is not None:
+        for begin in range(0, len(needs_model), MODEL_CHUNK_FRAMES):
+            chunk = needs_model[begin:begin + MODEL_CHUNK_FRAMES]
+            # Same 468x3 feature row that get_frame builds for the classifier
+            features = np.asarray(records['landmarks'][frames[chunk], :468, :], dtype=np.float64)
+            preds = np.asarray(model.predict(pd.DataFrame(features.reshape(len(chunk), -1))))
+            result[chunk[preds == 'Distracted']] = 'Looking Away'
+
+    statuses[single] = result
+    return statuses
+
+
+# --- 3. BATCH RE-SCORING ---
+
+_worker_model = None
+
+
+def _load_model(model_path):
+    global _worker_model
+    _worker_model = None
+    if model_path and os.path.exists(model_path):
+        with open(model_path, 'rb') as f:
+            _worker_model = pickle.load(f)
+
+
+def _rescore_one(args):
+    path, thresholds = args
+    try:
+        statuses = replay_statuses(load_landmarks(path), model=_worker_model, **thresholds)
+        return path, engagement_from_statuses(statuses)
+    except Exception as e:
+        # None rather than 0, so a broken file can't pass for a 0% session
+        print(f"Error re-scoring {path}: {e}")
+        return path, None
+
+
+def rescore_sessions(paths, model_path='engagement_model.pkl', processes=None, **thresholds):
+    """
+    Re-scores recorded sessions across a pool of worker processes.
+    Returns {path: engagement score}, with None for files that couldn't be read.
+    Pass model_path=None to skip the classifier.
+    """
+    paths = list(paths)
+    if not paths:
+        return {}
+    jobs = [(path, thresholds) for path in paths]
+    chunksize = max(1, len(jobs) // ((processes or os.cpu_count() or 1) * 4))
+    with ProcessPoolExecutor(max_workers=processes, initializer=_load_model, initargs=(model_path,)) as pool:
+        return dict(pool.map(_rescore_one, jobs, chunksize=chunksize))
+
+
+if __name__ == "__main__":
+    print("Re-scoring recorded sessions...")
+    scores = rescore_sessions(sorted(glob.glob("reports/*.lmk")))
+    for path, score in scores.items():
+        if score is None:
+            print(f"{os.path.basename(path)} | Could not be re-scored")
+        else:
+            print(f"{os.path.basename(path)} | Score: {score}%")
@@ -0,0 +1,267 @@
+import io
+import os
+import gc
+import sys
+import csv
+import time
+import weakref
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from types import SimpleNamespace
+from contextlib import redirect_stdout
+
+# --- 1. SETTINGS ---
+# Rows kept in memory before they are flushed to the session CSV
+DEFAULT_SESSION_CAP_BYTES = 8 * 1024 * 1024
+# A camera that hasn't served a frame for this long is treated as abandoned
+DEFAULT_IDLE_TIMEOUT = 120.0
+
+# --- 2. LIVE OBJECT COUNTS ---
+# Weak references only, so tracking never keeps a camera or graph alive
+_live_objects = {
+    'VideoCamera': weakref.WeakSet(),
+    'FaceMesh': weakref.WeakSet(),
+}
+
+def track(obj, kind):
+    _live_objects.setdefault(kind, weakref.WeakSet()).add(obj)
+
+def live_object_counts():
+    return {kind: len(objs) for kind, objs in _live_objects.items()}
+
+
+class SessionLog(object):
+    """
+    The per-frame (timestamp, status) log of a session.
+    Rows are buffered in memory and appended to the CSV whenever the buffer
+    reaches max_bytes, so a session of any length uses bounded memory.
+    """
+    COLUMNS = ['timestamp', 'status']
+    # list slot + 2-tuple + float; status strings are shared constants
+    ROW_BYTES = 8 + sys.getsizeof((0.0, '')) + sys.getsizeof(0.0)
+
+    def __init__(self, filename, max_bytes=DEFAULT_SESSION_CAP_BYTES):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.rows = []
+        self.rows_written = 0
+
+    def __len__(self):
+        return self.rows_written + len(self.rows)
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self.rows) + len(self.rows) * self.ROW_BYTES
+
+    def append(self, timestamp, status):
+        self.rows.append((timestamp, status))
+        if len(self.rows) * self.ROW_BYTES >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        folder = os.path.dirname(self.filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        new_file = self.rows_written == 0
+        with open(self.filename, 'w' if new_file else 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(self.COLUMNS)
+            writer.writerows(self.rows)
+        self.rows_written += len(self.rows)
+        # A fresh list gives the old buffer's memory back instead of keeping its capacity
+        self.rows = []
+
+
+# --- 3. PROCESS MEMORY ---
+
+def process_rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def start_tracing(frames=1):
+    # tracemalloc slows every allocation down, so it is only switched on at startup (TRACEMALLOC=1)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def allocation_snapshot(limit=10):
+    """Top allocation sites by size, or None when tracing wasn't started."""
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot()
+    stats = snapshot.statistics('lineno')[:limit]
+    return [{
+        'location': str(stat.traceback),
+        'size_bytes': stat.size,
+        'count': stat.count,
+    } for stat in stats]
+
+def memory_report(camera=None, snapshot=False):
+    report = {
+        'rss_bytes': process_rss_bytes(),
+        'live_objects': live_object_counts(),
+        'session': camera.memory_usage() if camera else None,
+    }
+    if snapshot:
+        report['allocations'] = allocation_snapshot()
+    return report
+
+
+# --- 4. SOAK TEST ---
+
+def _fake_face():
+    # A fixed grid of points: nothing degenerate, and the same face every frame
+    points = [SimpleNamespace(x=0.3 + 0.4 * (i % 22) / 22, y=0.3 + 0.4 * (i // 22) / 22, z=0.0)
+              for i in range(478)]
+    return SimpleNamespace(landmark=points)
+
+class _StubVideo(object):
+    # Serves `frames` small black frames, then reports the stream as ended
+    def __init__(self, frames=0):
+        self.opened = True
+        self.remaining = frames
+        self.frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    def isOpened(self):
+        return self.opened
+    def read(self):
+        if not self.opened or self.remaining <= 0:
+            return False, None
+        self.remaining -= 1
+        return True, self.frame
+    def release(self):
+        self.opened = False
+
+class _StubFaceMesh(object):
+    def __init__(self, faces=None):
+        self.results = SimpleNamespace(multi_face_landmarks=faces)
+    def process(self, image):
+        return self.results
+    def close(self):
+        pass
+
+def soak_frames(hours=3.0, fps=15, cap_bytes=256 * 1024, record_landmarks=True, tolerance_bytes=512 * 1024):
+    """
+    Replays a long session frame by frame through VideoCamera.get_frame, with
+    the webcam and FaceMesh stubbed, and checks that traced memory stays flat
+    once the first log buffer has been flushed.
+    """
+    from detection import VideoCamera
+
+    total_frames = int(hours * 3600 * fps)
+    sample_every = max(1, total_frames // 50)
+    old_cwd = os.getcwd()
+    baseline = None
+    peak_growth = 0
+    start = time.time()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # VideoCamera writes reports/ relative to the working directory
+        os.chdir(folder)
+        try:
+            camera = VideoCamera(record_landmarks=record_landmarks, max_session_bytes=cap_bytes,
+                                 video=_StubVideo(frames=total_frames),
+                                 face_mesh=_StubFaceMesh([_fake_face()]))
+            tracemalloc.start()
+            for i in range(total_frames):
+                if camera.get_frame() is None:
+                    break
+                if i % sample_every == 0:
+                    current, _ = tracemalloc.get_traced_memory()
+                    if baseline is None and camera.session_log.rows_written > 0:
+                        baseline = current
+                    elif baseline is not None:
+                        peak_growth = max(peak_growth, current - baseline)
+            tracemalloc.stop()
+            camera.stop_and_save()
+            rows_logged = len(camera.session_log)
+        finally:
+            os.chdir(old_cwd)
+
+    print(f"Frames: {total_frames} | Rows logged: {rows_logged} | "
+          f"Growth after warm-up: {peak_growth / 1024:.1f} KB | Took {time.time() - start:.1f}s")
+    return rows_logged == total_frames and baseline is not None and peak_growth <= tolerance_bytes
+
+def soak_sessions(cycles=200, rows_per_session=2000, tolerance_bytes=512 * 1024):
+    """
+    Opens sessions and abandons them (no /stop_analysis) so the reaper has to
+    clean up. The webcam and FaceMesh are stubbed. Checks that no camera or
+    graph survives a cycle and that traced memory stays flat across cycles.
+    """
+    old_cwd = os.getcwd()
+    leaked_cycles = 0
+    baseline = None
+    peak_growth = 0
+    start = time.time()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Importing app creates its databases; keep them out of the project folder
+        os.environ['USERS_DB'] = os.path.join(folder, 'users.db')
+        os.environ['JOBS_DB'] = os.path.join(folder, 'jobs.db')
+        import app as web
+        from detection import VideoCamera
+        idle_timeout = web.app.config['SESSION_IDLE_TIMEOUT']
+
+        # VideoCamera writes reports/ relative to the working directory
+        os.chdir(folder)
+        tracemalloc.start()
+        try:
+            for cycle in range(cycles):
+                camera = VideoCamera(video=_StubVideo(), face_mesh=_StubFaceMesh())
+                for i in range(rows_per_session):
+                    camera.session_log.append(start + i, 'Attentive')
+                with web.camera_lock:
+                    web.global_camera = camera
+
+                # The tab was closed: no frames since, so the reaper should take it
+                camera.last_active -= idle_timeout + 1
+                with redirect_stdout(io.StringIO()):
+                    web.reap_abandoned_sessions()
+                if web.global_camera is not None or not camera.stopped:
+                    leaked_cycles += 1
+                del camera
+                gc.collect()
+                if any(live_object_counts().values()):
+                    leaked_cycles += 1
+
+                current, _ = tracemalloc.get_traced_memory()
+                if cycle == cycles // 10:
+                    baseline = current
+                elif baseline is not None:
+                    peak_growth = max(peak_growth, current - baseline)
+        finally:
+            tracemalloc.stop()
+            os.chdir(old_cwd)
+
+    print(f"Sessions: {cycles} | Leaked cycles: {leaked_cycles} | Live: {live_object_counts()} | "
+          f"Growth after warm-up: {peak_growth / 1024:.1f} KB | Took {time.time() - start:.1f}s")
+    return leaked_cycles == 0 and baseline is not None and peak_growth <= tolerance_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory soak test for long monitoring sessions")
+    parser.add_argument('--hours', type=float, default=3.0, help="session length to replay (3h takes several minutes)")
+    parser.add_argument('--fps', type=int, default=15)
+    parser.add_argument('--no-landmarks', action='store_true', help="skip the landmark recorder")
+    parser.add_argument('--cycles', type=int, default=200, help="abandoned sessions to open and reap")
+    args = parser.parse_args()
+
+    print("Running memory soak test...")
+    frames_ok = soak_frames(hours=args.hours, fps=args.fps, record_landmarks=not args.no_landmarks)
+    sessions_ok = soak_sessions(cycles=args.cycles)
+    if frames_ok and sessions_ok:
+        print("PASS: memory stayed flat")
+    else:
+        print("FAIL: memory kept growing")
+        sys.exit(1)